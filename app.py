@@ -1,23 +1,114 @@
-from flask import Flask, jsonify, request, abort
+from flask import Flask, jsonify, request
+from flask.json.provider import DefaultJSONProvider
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-import json
-import requests
+from sqlalchemy import and_, bindparam, delete, event, func, insert, literal_column, select, text, type_coerce, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.schema import CreateColumn
+from cachetools import TTLCache
+import logging
+import orjson
+import threading
+
+log = logging.getLogger(__name__)
+
+class ORJSONProvider(DefaultJSONProvider):
+    # orjson is a C extension; use it for jsonify() and request.get_json()
+    def _option(self):
+        return orjson.OPT_SORT_KEYS if self.sort_keys else 0
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self._option()).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # orjson already produces UTF-8 bytes, so skip the str round trip.
+        # Output is always compact: the debug-mode indentation jsonify() adds
+        # (DefaultJSONProvider.compact) is dropped on purpose
+        if args and kwargs:
+            raise TypeError("app.json.response() takes either args or kwargs, not both")
+        if not args and not kwargs:
+            obj = None
+        elif len(args) == 1:
+            obj = args[0]
+        else:
+            obj = args or kwargs
+        data = orjson.dumps(obj, default=self.default, option=self._option() | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(data, mimetype=self.mimetype)
 
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
+
+# Shared by the writer and reader engines below
+SQLITE_ENGINE_OPTIONS = {
+    'poolclass': QueuePool,
+    'connect_args': {'check_same_thread': False},
+}
 
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///rides.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# SQLite allows one writer at a time, so writes share a single pooled
+# connection instead of contending for the database lock
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    **SQLITE_ENGINE_OPTIONS,
+    'pool_size': 1,
+    'max_overflow': 0,
+}
+# Reads get their own pool of read-only connections, which WAL lets run
+# alongside the writer; see execute_read()
+app.config['SQLALCHEMY_BINDS'] = {
+    'ro': {
+        **SQLITE_ENGINE_OPTIONS,
+        'url': 'sqlite:///file:rides.db?mode=ro&uri=true',
+        'pool_size': 8,
+        'max_overflow': 8,
+    },
+}
 db = SQLAlchemy(app)
-CORS(app)
+
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL + synchronous=NORMAL avoids an fsync on every commit and lets
+    # readers run while a write is in progress
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.execute("PRAGMA cache_size=-65536")
+    cursor.close()
+
+CORS(app, resources={r"/api/*": {"origins": "*"}})
+
+def load_json(value):
+    return orjson.loads(value) if isinstance(value, str) else value
+
+class JSONText(db.TypeDecorator):
+    # JSON stored as TEXT, encoded/decoded with orjson. SQLite gives a column
+    # declared JSON numeric affinity, which turns a top-level JSON number into
+    # an INTEGER/REAL; TEXT keeps the encoded value as written. Such numbers
+    # already stored by a JSON-declared column are passed through as-is
+    impl = db.Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return orjson.dumps(value).decode() if value is not None else None
+
+    def process_result_value(self, value, dialect):
+        return load_json(value)
 
 class Rider(db.Model):
     __tablename__ = 'riders'
     userName = db.Column(db.String(80), primary_key=True)
     ride_code = db.Column(db.String(20), nullable=True)
-    source = db.Column(db.String(250), nullable=True) # JSON string for source location details
-    destination = db.Column(db.String(250), nullable=True) # JSON string for destination location details
-    stops = db.Column(db.String(500), nullable=True) # JSON string for stops list
+    source = db.Column(JSONText, nullable=True) # Source location details
+    destination = db.Column(JSONText, nullable=True) # Destination location details
+    stops = db.Column(JSONText, nullable=True) # Stops list
     distance_travelled = db.Column(db.Float, default=0.0, nullable=True)
     average_speed = db.Column(db.Float, default=0.0, nullable=True)
     owner = db.Column(db.String(250))
@@ -29,8 +120,203 @@ class Rider(db.Model):
     # REMOVED: pickup_latitude = db.Column(db.Float, nullable=True)
     # REMOVED: pickup_longitude = db.Column(db.Float, nullable=True)
 
+    # Coordinates pulled out of the JSON columns by SQLite itself, so reads
+    # that only need lat/lng don't have to load and decode the JSON
+    source_lat = db.Column(db.Float, db.Computed("json_extract(source, '$.latitude')"))
+    source_lng = db.Column(db.Float, db.Computed("json_extract(source, '$.longitude')"))
+    dest_lat = db.Column(db.Float, db.Computed("json_extract(destination, '$.latitude')"))
+    dest_lng = db.Column(db.Float, db.Computed("json_extract(destination, '$.longitude')"))
+
+    __table_args__ = (
+        db.Index('ix_riders_ride_code', 'ride_code'),
+        db.Index('ix_riders_ridecode_status', 'ride_code', 'status'),
+    )
+
+class RideStop(db.Model):
+    # One row per stop, mirroring the usable entries of Rider.stops so stop
+    # coordinates can be queried (and later indexed) without decoding JSON
+    __tablename__ = 'ride_stops'
+    userName = db.Column(db.String(80), db.ForeignKey('riders.userName'), primary_key=True)
+    seq = db.Column(db.Integer, primary_key=True)
+    lat = db.Column(db.Float, nullable=False)
+    lng = db.Column(db.Float, nullable=False)
+    name = db.Column(JSONText, nullable=True) # Any JSON value, as posted
+
+def ride_stop_rows(userName, stops):
+    # The JSON column accepts any stops value, so rows are only derived from
+    # stop objects whose coordinates convert to floats; the rest are skipped
+    # rather than failing the write (or the startup backfill)
+    if type(stops) is not list:
+        return []
+    rows = []
+    for seq, stop in enumerate(stops):
+        if type(stop) is not dict:
+            continue
+        try:
+            lat = float(stop['latitude'])
+            lng = float(stop['longitude'])
+        except (KeyError, TypeError, ValueError, OverflowError):
+            continue
+        # NaN binds as NULL, which the NOT NULL columns reject
+        if lat != lat or lng != lng:
+            continue
+        rows.append({
+            'userName': userName,
+            'seq': seq,
+            'lat': lat,
+            'lng': lng,
+            'name': stop.get('name')
+        })
+    return rows
+
+# R*-tree over riders' current positions (degenerate boxes, min == max) so
+# "who is near" lookups are an index search instead of a table scan:
+#   SELECT i.userName FROM rider_rtree r JOIN rider_rtree_ids i USING (id)
+#   WHERE r.minLat >= :lat0 AND r.maxLat <= :lat1 AND r.minLng >= :lng0 AND r.maxLng <= :lng1
+# rtree ids must be integers, so rider_rtree_ids assigns one per userName.
+# Triggers keep it in step with every write to current_latitude/longitude.
+RIDER_RTREE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS rider_rtree USING rtree(id, minLat, maxLat, minLng, maxLng)",
+    "CREATE TABLE IF NOT EXISTS rider_rtree_ids (id INTEGER PRIMARY KEY, userName VARCHAR(80) NOT NULL UNIQUE)",
+    """CREATE TRIGGER IF NOT EXISTS rider_rtree_insert AFTER INSERT ON riders
+    WHEN NEW.current_latitude IS NOT NULL AND NEW.current_longitude IS NOT NULL
+    BEGIN
+        INSERT OR IGNORE INTO rider_rtree_ids (userName) VALUES (NEW.userName);
+        INSERT OR REPLACE INTO rider_rtree
+            SELECT id, NEW.current_latitude, NEW.current_latitude, NEW.current_longitude, NEW.current_longitude
+            FROM rider_rtree_ids WHERE userName = NEW.userName;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS rider_rtree_update AFTER UPDATE OF current_latitude, current_longitude ON riders
+    BEGIN
+        DELETE FROM rider_rtree WHERE id = (SELECT id FROM rider_rtree_ids WHERE userName = NEW.userName);
+        INSERT OR IGNORE INTO rider_rtree_ids (userName)
+            SELECT NEW.userName WHERE NEW.current_latitude IS NOT NULL AND NEW.current_longitude IS NOT NULL;
+        INSERT INTO rider_rtree
+            SELECT id, NEW.current_latitude, NEW.current_latitude, NEW.current_longitude, NEW.current_longitude
+            FROM rider_rtree_ids
+            WHERE userName = NEW.userName AND NEW.current_latitude IS NOT NULL AND NEW.current_longitude IS NOT NULL;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS rider_rtree_delete AFTER DELETE ON riders
+    BEGIN
+        DELETE FROM rider_rtree WHERE id = (SELECT id FROM rider_rtree_ids WHERE userName = OLD.userName);
+        DELETE FROM rider_rtree_ids WHERE userName = OLD.userName;
+    END""",
+]
+
 with app.app_context():
+    # ride_stops.name was first a VARCHAR of bare strings; the table only
+    # mirrors Rider.stops, so drop it and let the backfill below rebuild it
+    inspector = db.inspect(db.engine)
+    if inspector.has_table('ride_stops') and any(
+        c['name'] == 'name' and not isinstance(c['type'], db.Text) for c in inspector.get_columns('ride_stops')
+    ):
+        RideStop.__table__.drop(db.engine)
     db.create_all()
+    # Older databases predate the generated columns; SQLite can only add
+    # them as VIRTUAL, which is what Computed() renders by default
+    existing_columns = {c['name'] for c in db.inspect(db.engine).get_columns('riders')}
+    for column in Rider.__table__.columns:
+        if column.computed is not None and column.name not in existing_columns:
+            ddl = CreateColumn(column).compile(db.engine)
+            db.session.execute(text(f'ALTER TABLE riders ADD COLUMN {ddl}'))
+    db.session.commit()
+    # create_all() skips tables that already exist, so add new indexes separately
+    for index in Rider.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+    # Build the rider position index; fill it from existing rows the first time
+    rtree_exists = db.session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE name = 'rider_rtree'")
+    ).first() is not None
+    for ddl in RIDER_RTREE_DDL:
+        db.session.execute(text(ddl))
+    if not rtree_exists:
+        db.session.execute(text("""INSERT OR IGNORE INTO rider_rtree_ids (userName)
+            SELECT userName FROM riders WHERE current_latitude IS NOT NULL AND current_longitude IS NOT NULL"""))
+        db.session.execute(text("""INSERT INTO rider_rtree
+            SELECT i.id, r.current_latitude, r.current_latitude, r.current_longitude, r.current_longitude
+            FROM riders r JOIN rider_rtree_ids i ON i.userName = r.userName"""))
+    db.session.commit()
+    # Fill ride_stops from the JSON column for rides saved before it existed;
+    # only arrays can hold stops, so SQLite skips every other row
+    if db.session.execute(select(RideStop.userName).limit(1)).first() is None:
+        for userName, stops in db.session.execute(select(Rider.userName, Rider.stops).where(func.json_type(Rider.stops) == 'array')):
+            stop_rows = ride_stop_rows(userName, stops)
+            if stop_rows:
+                db.session.execute(insert(RideStop), stop_rows)
+        db.session.commit()
+
+def execute_read(statement, params):
+    return db.session.execute(statement, params, bind_arguments={'bind': db.engines['ro']})
+
+# Hot lookups built once at import; each request only binds parameters
+# Destination coordinates come from the generated columns, so only the
+# stops JSON is decoded; only a JSON object destination has coordinates to
+# report. Ordering by rowid keeps the row this returns stable
+# (ix_riders_ride_code already yields that order, so there is no sort)
+GET_RIDE_BY_RIDE_CODE = select(
+    (func.json_type(Rider.destination) == 'object').label('has_destination'), Rider.dest_lat, Rider.dest_lng, Rider.stops
+).where(Rider.ride_code == bindparam('ride_code')).order_by(literal_column('riders.rowid')).limit(1)
+# One row per stop, in order; a rider with no stops still yields one row.
+# source/destination repeat on every row, so they come back undecoded and
+# the handler decodes them once, from the first row
+GET_TRIP_BY_USERNAME = select(
+    type_coerce(Rider.source, db.Text).label('source'),
+    type_coerce(Rider.destination, db.Text).label('destination'),
+    Rider.ride_code, RideStop.lat, RideStop.lng, RideStop.name
+).outerjoin(RideStop, RideStop.userName == Rider.userName).where(
+    Rider.userName == bindparam('userName')
+).order_by(RideStop.seq)
+
+# Requesting rider LEFT JOIN the other active riders on the same ride, in one
+# statement: no rows means the rider doesn't exist, a NULL ride_code means
+# they aren't on a ride, and a NULL userName means the ride has nobody else
+_requesting_rider = aliased(Rider)
+
+GET_COWORKER_STATUSES = select(_requesting_rider.ride_code, Rider.userName, Rider.status).select_from(
+    _requesting_rider
+).outerjoin(Rider, and_(
+    Rider.ride_code == _requesting_rider.ride_code,
+    Rider.userName != _requesting_rider.userName,
+    Rider.status == 'active'
+)).where(_requesting_rider.userName == bindparam('userName'))
+
+GET_RIDE_CODE_BY_USERNAME = select(Rider.ride_code).where(Rider.userName == bindparam('userName'))
+# Riders without pickup coordinates are dropped by SQLite, not in Python
+GET_ACTIVE_PICKUPS_ON_RIDE = select(Rider.userName, Rider.source_lat, Rider.source_lng).where(
+    Rider.ride_code == bindparam('ride_code'),
+    Rider.status == 'active',
+    Rider.source_lat.isnot(None),
+    Rider.source_lng.isnot(None)
+)
+
+# Every rider on a ride polls the coworker locations, so cache each ride's
+# pickups briefly: K riders polling cost one query per ride per second.
+# Entries are dropped on writes; the TTL bounds staleness across workers.
+ride_pickups_cache = TTLCache(maxsize=1024, ttl=1.0)
+ride_pickups_lock = threading.Lock()
+
+def get_ride_pickups(ride_code):
+    with ride_pickups_lock:
+        pickups = ride_pickups_cache.get(ride_code)
+    if pickups is None:
+        # Each entry is encoded once here with orjson (keys in sorted order,
+        # as jsonify would emit them), so cache hits only splice bytes
+        pickups = [
+            (userName, orjson.dumps({'latitude': lat, 'longitude': lng, 'username': userName}))
+            for userName, lat, lng in execute_read(GET_ACTIVE_PICKUPS_ON_RIDE, {'ride_code': ride_code})
+        ]
+        with ride_pickups_lock:
+            ride_pickups_cache[ride_code] = pickups
+    return pickups
+
+def invalidate_ride_pickups(*ride_codes):
+    with ride_pickups_lock:
+        for ride_code in ride_codes:
+            ride_pickups_cache.pop(ride_code, None)
+
+def clear_ride_pickups():
+    with ride_pickups_lock:
+        ride_pickups_cache.clear()
 
 @app.route('/api/riders', methods=['POST'])
 def create_rider():
@@ -38,14 +324,14 @@ def create_rider():
     if not data or 'userName' not in data:
         return jsonify({'error': 'Missing required field: userName'}), 400
 
-    if db.session.get(Rider, data['userName']):
-        return jsonify({'error': 'Rider with this name already exists'}), 409
-
+    # Let the primary key reject duplicates instead of checking first
     try:
-        rider = Rider(userName=data['userName'])
-        db.session.add(rider)
+        db.session.add(Rider(userName=data['userName']))
         db.session.commit()
-        return jsonify({'userName': rider.userName}), 201
+        return jsonify({'userName': data['userName']}), 201
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'error': 'Rider with this name already exists'}), 409
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -53,46 +339,54 @@ def create_rider():
 @app.route('/api/info', methods=['POST'])
 def ride_info():
     data = request.get_json()
-    userName = data.get('userName')
-    pickup = data.get('pickup')
-    destination = data.get('destination')
-    stops = data.get('stops', [])
-    ride_code = data.get('generatedCode')
-    owner = data.get('owner')
-    status = data.get('status')
+    # Missing 'stops' comes through as None, which is handled like []
+    userName, pickup, destination, stops, ride_code, owner, status = map(data.get, (
+        'userName', 'pickup', 'destination', 'stops', 'generatedCode', 'owner', 'status'
+    ))
 
     if not userName:
         return jsonify({'success': False, 'message': 'userName is required'}), 400
 
-    rider = db.session.get(Rider, userName)
-    if not rider:
-        return jsonify({'success': False, 'message': 'Rider not found'}), 404
-
-    rider.source = json.dumps(pickup) if pickup else None
-    rider.destination = json.dumps(destination) if destination else None
-    rider.current_latitude= pickup.get('latitude') if pickup and 'latitude' in pickup else None
-    rider.current_longitude = pickup.get('longitude') if pickup and 'longitude' in pickup else None
-    rider.stops = json.dumps(stops) if stops else None
-    rider.ride_code = ride_code
-    rider.owner = owner
-    rider.status = status
-
-    # No longer storing pickup_latitude/longitude as separate columns
-    # They are part of the 'source' JSON string.
-
-    db.session.commit()
-
+    # One explicit transaction with autoflush off: the rider's UPDATE is sent
+    # once at commit, not flushed early by the ride_stops statements
+    with db.session.no_autoflush, db.session.begin():
+        rider = db.session.get(Rider, userName)
+        if not rider:
+            return jsonify({'success': False, 'message': 'Rider not found'}), 404
+
+        previous_ride_code = rider.ride_code
+        rider.source = pickup if pickup else None
+        rider.destination = destination if destination else None
+        rider.current_latitude= pickup.get('latitude') if pickup and 'latitude' in pickup else None
+        rider.current_longitude = pickup.get('longitude') if pickup and 'longitude' in pickup else None
+        rider.stops = stops if stops else None
+        rider.ride_code = ride_code
+        rider.owner = owner
+        rider.status = status
+
+        # No longer storing pickup_latitude/longitude as separate columns
+        # They are part of the 'source' JSON column.
+
+        db.session.execute(delete(RideStop).where(RideStop.userName == userName))
+        stop_rows = ride_stop_rows(userName, stops or [])
+        if stop_rows:
+            db.session.execute(insert(RideStop), stop_rows)
+
+    invalidate_ride_pickups(previous_ride_code, ride_code)
+
+    # Echo the request values rather than reading them back off `rider`:
+    # commit() expired its attributes, so that would reload and re-decode the row
     return jsonify({
         'success': True,
         'message': 'Ride info stored',
         'rider': {
-            'userName': rider.userName,
-            'pickup': json.loads(rider.source) if rider.source else None,
-            'destination': json.loads(rider.destination) if rider.destination else None,
-            'stops': json.loads(rider.stops) if rider.stops else [],
-            'ride_code': rider.ride_code,
-            'owner': rider.owner,
-            'status': rider.status,
+            'userName': userName,
+            'pickup': pickup if pickup else None,
+            'destination': destination if destination else None,
+            'stops': stops if stops else [],
+            'ride_code': ride_code,
+            'owner': owner,
+            'status': status,
             # Removed direct pickup_latitude/longitude from response as well
         }
     })
@@ -100,9 +394,9 @@ def ride_info():
 @app.route('/api/trips/<userName>', methods=['GET'])
 def get_trip_data_by_username(userName):
 
-    rider = db.session.get(Rider, userName)
-    print(userName)
-    if not rider:
+    rows = execute_read(GET_TRIP_BY_USERNAME, {'userName': userName}).all()
+    log.debug("Trip data requested for %s", userName)
+    if not rows:
         return jsonify({
             'pickup': None,
             'destination': None,
@@ -110,9 +404,9 @@ def get_trip_data_by_username(userName):
             'ride_code': None
         }), 404
 
-    pickup_data = json.loads(rider.source) if rider.source else None
-    destination_data = json.loads(rider.destination) if rider.destination else None
-    stops_data = json.loads(rider.stops) if rider.stops else []
+    rider = rows[0]
+    pickup_data = load_json(rider.source)
+    destination_data = load_json(rider.destination)
 
     formatted_pickup = None
     if pickup_data and 'latitude' in pickup_data and 'longitude' in pickup_data:
@@ -130,14 +424,11 @@ def get_trip_data_by_username(userName):
             'name': destination_data.get('name')
         }
 
-    formatted_stops = []
-    for stop in stops_data:
-        if isinstance(stop, dict) and 'latitude' in stop and 'longitude' in stop:
-            formatted_stops.append({
-                'latitude': float(stop['latitude']),
-                'longitude': float(stop['longitude']),
-                'name': stop.get('name')
-            })
+    formatted_stops = [{
+        'latitude': row.lat,
+        'longitude': row.lng,
+        'name': row.name
+    } for row in rows if row.lat is not None]
 
     return jsonify({
         'pickup': formatted_pickup,
@@ -148,31 +439,20 @@ def get_trip_data_by_username(userName):
 
 @app.route('/api/ride/<ride_code>', methods=['GET'])
 def get_ride_by_code(ride_code):
-    rider = Rider.query.filter_by(ride_code=ride_code).first()
-    if not rider:
+    ride = execute_read(GET_RIDE_BY_RIDE_CODE, {'ride_code': ride_code}).first()
+    if not ride:
         return jsonify({'error': 'Ride not found'}), 404
 
     destination = None
-    if rider.destination:
-        try:
-            dest_data = json.loads(rider.destination)
-            destination = {
-                'latitude': dest_data.get('latitude'),
-                'longitude': dest_data.get('longitude')
-            }
-        except Exception:
-            destination = None
-
-    stops = []
-    if rider.stops:
-        try:
-            stops = json.loads(rider.stops)
-        except Exception:
-            stops = []
+    if ride.has_destination:
+        destination = {
+            'latitude': ride.dest_lat,
+            'longitude': ride.dest_lng
+        }
 
     return jsonify({
         'destination': destination,
-        'stops': stops
+        'stops': ride.stops or []
     })
 
 @app.route('/api/update-ride-status/<userName>', methods=['POST'])
@@ -184,72 +464,76 @@ def update_ride_status(userName):
     if not status:
         return jsonify({'success': False, 'message': 'status is required'}), 400
 
-    rider = db.session.get(Rider, userName)
-    if not rider:
-        return jsonify({'success': False, 'message': 'Rider not found'}), 404
-
     try:
         if status == 'inactive':
             # Only update the status to 'inactive'
-            rider.status = 'inactive'
-            db.session.commit()
-            return jsonify({
-                'success': True,
-                'message': f'Rider {userName} status updated to inactive'
-            }), 200
+            values = {'status': 'inactive'}
+            message = f'Rider {userName} status updated to inactive'
         elif status == 'done':
             # Set all relevant columns to null except userName
-            rider.ride_code = None
-            rider.source = None
-            rider.destination = None
-            rider.stops = None
-            rider.distance_travelled = 0.0 # Reset to default or None as per preference
-            rider.average_speed = 0.0    # Reset to default or None as per preference
-            rider.owner = None
-            rider.status = 'done' # Set status to 'done'
-            rider.current_latitude = None
-            rider.current_longitude = None
-            rider.expo_push_token = None # Clear push token if ride is done
-
-            db.session.commit()
-            return jsonify({
-                'success': True,
-                'message': f'Rider {userName} ride marked as done and details cleared'
-            }), 200
+            values = {
+                'ride_code': None,
+                'source': None,
+                'destination': None,
+                'stops': None,
+                'distance_travelled': 0.0, # Reset to default or None as per preference
+                'average_speed': 0.0,    # Reset to default or None as per preference
+                'owner': None,
+                'status': 'done', # Set status to 'done'
+                'current_latitude': None,
+                'current_longitude': None,
+                'expo_push_token': None # Clear push token if ride is done
+            }
+            message = f'Rider {userName} ride marked as done and details cleared'
         else:
-            rider.status = 'active'
-            db.session.commit()
-            return jsonify({
-                'success': True,
-                'message': f'Rider {userName} status updated to active'
-            }), 200
+            values = {'status': 'active'}
+            message = f'Rider {userName} status updated to active'
+
+        # One UPDATE, no SELECT first; RETURNING doubles as the existence check
+        with db.session.begin():
+            ride_codes = db.session.execute(
+                update(Rider).where(Rider.userName == userName).values(values).returning(Rider.ride_code),
+                execution_options={'synchronize_session': False}
+            ).scalars().all()
+            if ride_codes and status == 'done':
+                db.session.execute(delete(RideStop).where(RideStop.userName == userName))
+        if not ride_codes:
+            return jsonify({'success': False, 'message': 'Rider not found'}), 404
+
+        if status == 'done':
+            # RETURNING only sees the cleared ride_code; ending a ride is rare
+            # next to coworker polling, so just drop every cached ride
+            clear_ride_pickups()
+        else:
+            invalidate_ride_pickups(*ride_codes)
+
+        return jsonify({
+            'success': True,
+            'message': message
+        }), 200
 
     except Exception as e:
         db.session.rollback()
-        print(f"Error updating rider status for {userName}: {e}")
+        log.error("Error updating rider status for %s: %s", userName, e)
         return jsonify({'success': False, 'message': 'An error occurred while updating rider status'}), 500
 
 @app.route('/api/riders/by_user/<username>', methods=['GET'])
 def get_riders_by_username(username):
-    requesting_rider = db.session.get(Rider, username)
-    if not requesting_rider:
+    rows = execute_read(GET_COWORKER_STATUSES, {'userName': username}).all()
+    if not rows:
         return jsonify({'message': 'Requesting rider not found'}), 404
 
-    if not requesting_rider.ride_code:
+    if not rows[0].ride_code:
         return jsonify({'message': 'Requesting rider is not part of a ride (no ride_code assigned)'}), 400
 
-    active_riders_on_same_ride = Rider.query.filter(
-        Rider.ride_code == requesting_rider.ride_code,
-        Rider.userName != username,
-        Rider.status == 'active'
-    ).all()
-
     riders_data = []
-    for rider in active_riders_on_same_ride:
+    for _, rider_name, rider_status in rows:
+        if rider_name is None:
+            continue
         riders_data.append({
-            'id': rider.userName,
-            'name': rider.userName,
-            'status': rider.status
+            'id': rider_name,
+            'name': rider_name,
+            'status': rider_status
         })
 
     return jsonify({'riders': riders_data})
@@ -259,8 +543,8 @@ def get_riders_by_username(username):
 def get_coworkers_pickup_locations(username):
     requesting_username = username
 
-    requesting_rider = db.session.get(Rider, requesting_username)
-    print(requesting_rider)
+    requesting_rider = execute_read(GET_RIDE_CODE_BY_USERNAME, {'userName': requesting_username}).first()
+    log.debug("Coworker locations requested by %s", requesting_username)
     if not requesting_rider:
         return jsonify({"message": "Requesting rider not found."}), 404
 
@@ -269,32 +553,19 @@ def get_coworkers_pickup_locations(username):
 
     active_ride_code = requesting_rider.ride_code
 
-    # Query for all other riders on the same ride
-    coworkers = Rider.query.filter(
-        Rider.ride_code == active_ride_code,
-        Rider.userName != requesting_username,
-        Rider.status == 'active'
-    ).all()
-
-    locations = []
-    for coworker in coworkers:
-        # Safely parse the 'source' JSON to get latitude and longitude
-        if coworker.source:
-            try:
-                source_data = json.loads(coworker.source)
-                if 'latitude' in source_data and 'longitude' in source_data:
-                    locations.append({
-                        "latitude": float(source_data['latitude']),
-                        "longitude": float(source_data['longitude']),
-                        "username": coworker.userName # Include username for marker title
-                    })
-            except json.JSONDecodeError:
-                print(f"Warning: Could not decode source JSON for rider {coworker.userName}")
-            except KeyError:
-                print(f"Warning: 'latitude' or 'longitude' missing in source for rider {coworker.userName}")
-
-
-    return jsonify({"coworker_pickup_locations": locations}), 200
+    # All active riders on the ride (cached, each entry already encoded by
+    # get_ride_pickups); drop the requesting rider and splice the rest into
+    # the response body
+    locations = b','.join(
+        location for coworker_name, location in get_ride_pickups(active_ride_code)
+        if coworker_name != requesting_username
+    )
+    return app.response_class(
+        b'{"coworker_pickup_locations":[' + locations + b']}\n',
+        status=200,
+        mimetype='application/json'
+    )
 
 if __name__ == '__main__':
+    # Local development only; production serves wsgi:app under gunicorn
     app.run(debug=True, host="0.0.0.0", port=5000)
\ No newline at end of file
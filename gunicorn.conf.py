@@ -0,0 +1,8 @@
+# gunicorn -c gunicorn.conf.py wsgi:app
+# SQLite allows a single writer, so run one process and get concurrency from
+# threads: reads spread over the read-only pool, writes queue for the writer
+# connection. WAL and check_same_thread=False are set up in app.py.
+bind = '0.0.0.0:5000'
+worker_class = 'gthread'
+workers = 1
+threads = 16
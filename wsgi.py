@@ -0,0 +1,3 @@
+# Production entry point: gunicorn -c gunicorn.conf.py wsgi:app
+# The __main__ block in app.py runs the Werkzeug dev server and is for local use only.
+from app import app